@@ -1,8 +1,11 @@
 import os
 import chromadb
+import numpy as np
+from typing import List, Optional
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 from dotenv import load_dotenv
+from config.http_clients import get_http_client, get_http_async_client
 
 # Load environment variables
 load_dotenv()
@@ -13,13 +16,56 @@ load_dotenv()
 CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
 CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")  # Default Chroma port is 8001
 
-# Initialize embeddings with error handling
+
+
+class NormalizedOpenAIEmbeddings(OpenAIEmbeddings):
+    """OpenAI embeddings scaled to unit length, so inner product equals cosine similarity"""
+
+    @staticmethod
+    def _normalize(vectors: List[List[float]]) -> List[List[float]]:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.size == 0:
+            return []
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return (matrix / norms).tolist()
+
+    def embed_documents(self, texts: List[str], chunk_size: Optional[int] = 0) -> List[List[float]]:
+        return self._normalize(super().embed_documents(texts, chunk_size))
+
+    async def aembed_documents(self, texts: List[str], chunk_size: Optional[int] = 0) -> List[List[float]]:
+        return self._normalize(await super().aembed_documents(texts, chunk_size))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._normalize([super().embed_query(text)])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._normalize([await super().aembed_query(text)])[0]
+
+
+# Initialize embeddings lazily with error handling
+_embeddings = None
 
 
 def get_embeddings():
     """Get OpenAI embeddings - automatically loads OPENAI_API_KEY from environment"""
+    global _embeddings
+    if _embeddings is not None:
+        return _embeddings
     try:
-        return OpenAIEmbeddings()
+        # Send up to 1000 inputs per embeddings request (ingestion also bounds each
+        # request's total tokens, see _embedding_batches) as plain strings: chunks
+        # are far below the model's context length, so skip the client-side
+        # tiktoken pass that re-tokenizes every input and sends token IDs instead
+        _embeddings = NormalizedOpenAIEmbeddings(
+            chunk_size=1000,
+            check_embedding_ctx_length=False,
+            # Retries are handled (and rate limited) by config.rate_limit only
+            max_retries=0,
+            http_client=get_http_client(),
+            http_async_client=get_http_async_client()
+        )
+        return _embeddings
     except Exception as e:
         raise ValueError(
             "OPENAI_API_KEY not found. Please set it in your .env file or environment variables. "
@@ -27,6 +73,12 @@ def get_embeddings():
         )
 
 
+def reset_embeddings():
+    """Drop the embeddings client, e.g. once the shared HTTP clients it uses are closed"""
+    global _embeddings
+    _embeddings = None
+
+
 # Initialize ChromaDB client lazily
 _client = None
 
@@ -58,5 +110,8 @@ def get_vectorstore(collection_name="documents"):
     return Chroma(
         client=client,
         collection_name=collection_name,
-        embedding_function=embeddings
+        embedding_function=embeddings,
+        # Embeddings are unit-normalized, so inner product is cosine similarity.
+        # Only applies when the collection is first created.
+        collection_metadata={"hnsw:space": "ip"}
     )
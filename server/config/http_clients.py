@@ -0,0 +1,37 @@
+import httpx
+
+# Pooled keep-alive connections shared by every OpenAI client in the process,
+# so embedding / chat calls reuse TLS connections instead of re-handshaking.
+# HTTP/2 multiplexes concurrent requests over a single connection.
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+# Initialize HTTP clients lazily
+_http_client = None
+_http_async_client = None
+
+
+def get_http_client() -> httpx.Client:
+    """Get the shared sync HTTP client"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=HTTP_LIMITS, http2=True)
+    return _http_client
+
+
+def get_http_async_client() -> httpx.AsyncClient:
+    """Get the shared async HTTP client"""
+    global _http_async_client
+    if _http_async_client is None:
+        _http_async_client = httpx.AsyncClient(limits=HTTP_LIMITS, http2=True)
+    return _http_async_client
+
+
+async def close_http_clients() -> None:
+    """Close the shared HTTP clients, e.g. on app shutdown"""
+    global _http_client, _http_async_client
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+    if _http_async_client is not None:
+        await _http_async_client.aclose()
+        _http_async_client = None
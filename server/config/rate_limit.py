@@ -0,0 +1,83 @@
+import os
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from aiolimiter import AsyncLimiter
+from dotenv import load_dotenv
+from openai import RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# Load environment variables
+load_dotenv()
+
+# OpenAI rate limits - match these to your account tier
+# (e.g. 35 / 60 / 125 concurrent requests for tier 1 / 2 / 4)
+OPENAI_MAX_CONCURRENT = int(os.getenv("OPENAI_MAX_CONCURRENT", "35"))
+OPENAI_MAX_REQUESTS_PER_MINUTE = int(
+    os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", "500"))
+
+# Shared by every OpenAI call in the process
+_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENT)
+_limiter = AsyncLimiter(OPENAI_MAX_REQUESTS_PER_MINUTE, 60)
+
+# 1, 2, 4, 8, 16 seconds between attempts
+_backoff = wait_exponential(multiplier=1, min=1, max=16)
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Honor the Retry-After header on 429s, falling back to exponential backoff"""
+    exception = retry_state.outcome.exception()
+    response = getattr(exception, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return _backoff(retry_state)
+
+
+@asynccontextmanager
+async def openai_slot():
+    """
+    Hold a concurrency slot and a rate-limit token for the duration of a
+    request, e.g. while consuming a streamed response
+    """
+    async with _semaphore:
+        async with _limiter:
+            yield
+
+
+# Retry policy shared by every OpenAI call: 429s only, up to 6 attempts
+openai_retry = retry(
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(RateLimitError),
+    reraise=True
+)
+
+
+@openai_retry
+async def call_openai(fn, *args, **kwargs):
+    """
+    Await an async OpenAI-backed call (e.g. `aembed_documents`, `ainvoke`)
+    under the concurrency cap and requests-per-minute token bucket
+    """
+    async with openai_slot():
+        return await fn(*args, **kwargs)
+
+
+@openai_retry
+async def open_openai_stream(open_stream, stack: AsyncExitStack):
+    """
+    Open a streamed OpenAI response (`open_stream()` returns an async iterator)
+    and wait for its first chunk. 429s before the first chunk are retried like
+    `call_openai`; the concurrency slot stays held by `stack` until it is closed.
+    Returns the iterator and the first chunk (None if the stream was empty)
+    """
+    async with AsyncExitStack() as attempt:
+        await attempt.enter_async_context(openai_slot())
+        stream = open_stream().__aiter__()
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        stack.push_async_exit(attempt.pop_all())
+    return stream, first
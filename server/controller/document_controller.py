@@ -1,19 +1,133 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse, StreamingResponse
-from typing import Optional
-from service.document_service import DocumentService
-import io
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from typing import Callable, List, Optional, BinaryIO
+from service.document_service import DocumentService, dump_event
+from service.exceptions import ServiceError
+import codecs
 import PyPDF2
-import json
 import asyncio
 
-router = APIRouter(prefix="/api/documents", tags=["documents"])
+
+class ServiceErrorRoute(APIRoute):
+    """
+    Report unexpected route and dependency errors as ServiceError, so they are
+    handled inside the CORS middleware and the response keeps its CORS headers
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            try:
+                return await handler(request)
+            except (StarletteHTTPException, RequestValidationError, ServiceError):
+                raise
+            except Exception as e:
+                raise ServiceError(f"Internal server error: {str(e)}", error=str(e)) from e
+
+        return route_handler
+
+
+router = APIRouter(prefix="/api/documents", tags=["documents"], route_class=ServiceErrorRoute)
+
+# Uploads are decoded in 1MB pieces instead of reading the whole file at once
+UPLOAD_READ_SIZE = 1 << 20
 
 # Dependency to get document service
+# The service (and its LLM / Chroma clients) is built once and shared across requests
+_SERVICE: Optional[DocumentService] = None
 
 
 def get_document_service() -> DocumentService:
-    return DocumentService()
+    global _SERVICE
+    if _SERVICE is None:
+        _SERVICE = DocumentService()
+    return _SERVICE
+
+
+def reset_document_service() -> None:
+    """Drop the shared service, so the next request (or app startup) builds a fresh one"""
+    global _SERVICE
+    _SERVICE = None
+
+
+def _extract_pdf_text(stream: BinaryIO) -> str:
+    """
+    Extract text from all PDF pages - CPU bound, so run it off the event loop
+    """
+    pdf_reader = PyPDF2.PdfReader(stream)
+    return "\n".join([page.extract_text() for page in pdf_reader.pages])
+
+
+async def _read_upload_text(file: UploadFile) -> str:
+    """
+    Extract the text of an uploaded .txt or .pdf file
+    """
+    # Validate file
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    # Extract text based on file type
+    file_content = ""
+    if file.filename.lower().endswith('.pdf'):
+        # Handle PDF files - read straight from the upload's spooled temp file
+        # (kept in memory when small, on disk when large)
+        try:
+            await file.seek(0)
+            file_content = await run_in_threadpool(_extract_pdf_text, file.file)
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Error processing PDF file: {str(e)}"
+            )
+
+        if not file_content.strip():
+            raise HTTPException(
+                status_code=400,
+                detail="Could not extract text from PDF. The file might be scanned or image-based."
+            )
+    elif file.filename.lower().endswith('.txt'):
+        # Handle text files
+        try:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            parts = []
+            while chunk := await file.read(UPLOAD_READ_SIZE):
+                parts.append(decoder.decode(chunk))
+            parts.append(decoder.decode(b'', final=True))
+            file_content = ''.join(parts)
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400,
+                detail="Text file must be UTF-8 encoded"
+            )
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail="Unsupported file type. Please upload .txt or .pdf files only."
+        )
+
+    return file_content
+
+
+def _build_metadata(file: UploadFile, description: Optional[str], tags: Optional[str]) -> dict:
+    """
+    Prepare the metadata stored with every chunk of an uploaded file
+    """
+    metadata = {
+        "description": description,
+        "file_size": file.size,
+        "content_type": file.content_type,
+        "file_type": file.filename.split('.')[-1].lower()
+    }
+
+    if tags:
+        metadata["tags"] = [tag.strip() for tag in tags.split(",")]
+
+    return metadata
 
 
 @router.post("/upload")
@@ -30,82 +144,54 @@ async def upload_document(
     - **description**: Optional description of the document
     - **tags**: Optional comma-separated tags
     """
-    try:
-        # Validate file
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
-
-        # Read file content
-        content = await file.read()
-
-        # Extract text based on file type
-        file_content = ""
-        if file.filename.lower().endswith('.pdf'):
-            # Handle PDF files
-            try:
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-                for page in pdf_reader.pages:
-                    file_content += page.extract_text() + "\n"
-
-                if not file_content.strip():
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Could not extract text from PDF. The file might be scanned or image-based."
-                    )
-            except Exception as e:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Error processing PDF file: {str(e)}"
-                )
-        elif file.filename.lower().endswith('.txt'):
-            # Handle text files
-            try:
-                file_content = content.decode('utf-8')
-            except UnicodeDecodeError:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Text file must be UTF-8 encoded"
-                )
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail="Unsupported file type. Please upload .txt or .pdf files only."
-            )
+    file_content = await _read_upload_text(file)
 
-        # Prepare metadata
-        metadata = {
-            "description": description,
-            "file_size": len(content),
-            "content_type": file.content_type,
-            "file_type": file.filename.split('.')[-1].lower()
+    # Process and store document
+    result = await document_service.process_and_store_document(
+        file_content=file_content,
+        filename=file.filename,
+        metadata=_build_metadata(file, description, tags)
+    )
+
+    return JSONResponse(
+        status_code=201,
+        content={
+            "message": "Document uploaded and processed successfully",
+            "data": result
         }
+    )
 
-        if tags:
-            metadata["tags"] = [tag.strip() for tag in tags.split(",")]
 
-        # Process and store document
-        result = await document_service.process_and_store_document(
-            file_content=file_content,
-            filename=file.filename,
-            metadata=metadata
-        )
+@router.post("/upload/batch")
+async def upload_documents(
+    files: List[UploadFile] = File(...),
+    description: Optional[str] = Form(None),
+    tags: Optional[str] = Form(None),
+    document_service: DocumentService = Depends(get_document_service)
+):
+    """
+    Upload and process several documents at once
 
-        if result["success"]:
-            return JSONResponse(
-                status_code=201,
-                content={
-                    "message": "Document uploaded and processed successfully",
-                    "data": result
-                }
-            )
-        else:
-            raise HTTPException(status_code=500, detail=result["message"])
+    - **files**: The document files to upload (supports .txt and .pdf files)
+    - **description**: Optional description applied to every document
+    - **tags**: Optional comma-separated tags applied to every document
+    """
+    documents = []
+    for file in files:
+        file_content = await _read_upload_text(file)
+        documents.append(
+            (file_content, file.filename, _build_metadata(file, description, tags)))
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Internal server error: {str(e)}")
+    # Split all documents in parallel and store them in one write
+    result = await document_service.process_and_store_documents(documents)
+
+    return JSONResponse(
+        status_code=201,
+        content={
+            "message": "Documents uploaded and processed successfully",
+            "data": result
+        }
+    )
 
 
 @router.post("/query")
@@ -113,6 +199,7 @@ async def query_documents(
     query: str = Form(...),
     k: Optional[int] = Form(5),
     document_id: Optional[str] = Form(None), # Added document_id
+    max_tokens: Optional[int] = Form(None),
     document_service: DocumentService = Depends(get_document_service)
 ):
     """
@@ -121,42 +208,38 @@ async def query_documents(
     - **query**: The question or query to search for
     - **k**: Number of results to return (default: 5)
     - **document_id**: Optional document ID to search within specific document first
+    - **max_tokens**: Optional cap on answer length in tokens (default: 300, max: 4096)
     """
-    try:
-        if not query.strip():
-            raise HTTPException(
-                status_code=400, detail="Query cannot be empty")
-
-        # Ensure k has a valid value
-        k_value = k if k is not None else 5
-
-        if k_value < 1 or k_value > 20:
-            raise HTTPException(
-                status_code=400, detail="k must be between 1 and 20")
+    if not query.strip():
+        raise HTTPException(
+            status_code=400, detail="Query cannot be empty")
 
-        # Search documents with smart search (document-specific first, then global)
-        result = await document_service.search_documents(
-            query=query,
-            k=k_value,
-            document_id=document_id
-        )
+    # Ensure k has a valid value
+    k_value = k if k is not None else 5
 
-        if result["success"]:
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": "Query executed successfully",
-                    "data": result
-                }
-            )
-        else:
-            raise HTTPException(status_code=500, detail=result["message"])
+    if k_value < 1 or k_value > 20:
+        raise HTTPException(
+            status_code=400, detail="k must be between 1 and 20")
 
-    except HTTPException:
-        raise
-    except Exception as e:
+    if max_tokens is not None and (max_tokens < 1 or max_tokens > 4096):
         raise HTTPException(
-            status_code=500, detail=f"Internal server error: {str(e)}")
+            status_code=400, detail="max_tokens must be between 1 and 4096")
+
+    # Search documents with smart search (document-specific first, then global)
+    result = await document_service.search_documents(
+        query=query,
+        k=k_value,
+        document_id=document_id,
+        max_tokens=max_tokens
+    )
+
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "Query executed successfully",
+            "data": result
+        }
+    )
 
 
 @router.post("/query/stream")
@@ -164,6 +247,7 @@ async def query_documents_stream(
     query: str = Form(...),
     k: Optional[int] = Form(5),
     document_id: Optional[str] = Form(None),
+    max_tokens: Optional[int] = Form(None),
     document_service: DocumentService = Depends(get_document_service)
 ):
     """
@@ -174,54 +258,53 @@ async def query_documents_stream(
     - **query**: The question or query to search for
     - **k**: Number of results to return (default: 5)
     - **document_id**: Optional document ID to search within specific document first
+    - **max_tokens**: Optional cap on answer length in tokens (default: 300, max: 4096)
     """
-    try:
-        if not query.strip():
-            raise HTTPException(
-                status_code=400, detail="Query cannot be empty")
-
-        # Ensure k has a valid value
-        k_value = k if k is not None else 5
+    if not query.strip():
+        raise HTTPException(
+            status_code=400, detail="Query cannot be empty")
 
-        if k_value < 1 or k_value > 20:
-            raise HTTPException(
-                status_code=400, detail="k must be between 1 and 20")
+    # Ensure k has a valid value
+    k_value = k if k is not None else 5
 
-        async def generate_stream():
-            try:
-                async for event_data in document_service.search_documents_stream(
-                    query=query,
-                    k=k_value,
-                    document_id=document_id
-                ):
-                    yield f"data: {event_data}\n\n"
-                    
-            except Exception as e:
-                # Send error event
-                error_event = json.dumps({
-                    "event": "error",
-                    "error": str(e),
-                    "timestamp": asyncio.get_event_loop().time()
-                })
-                yield f"data: {error_event}\n\n"
-
-        return StreamingResponse(
-            generate_stream(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "Cache-Control"
-            }
-        )
+    if k_value < 1 or k_value > 20:
+        raise HTTPException(
+            status_code=400, detail="k must be between 1 and 20")
 
-    except HTTPException:
-        raise
-    except Exception as e:
+    if max_tokens is not None and (max_tokens < 1 or max_tokens > 4096):
         raise HTTPException(
-            status_code=500, detail=f"Internal server error: {str(e)}")
+            status_code=400, detail="max_tokens must be between 1 and 4096")
+
+    async def generate_stream():
+        try:
+            async for event_data in document_service.search_documents_stream(
+                query=query,
+                k=k_value,
+                document_id=document_id,
+                max_tokens=max_tokens
+            ):
+                yield f"data: {event_data}\n\n"
+                
+        except Exception as e:
+            # Send error event
+            error_event = dump_event({
+                "event": "error",
+                "error": str(e),
+                "timestamp": asyncio.get_running_loop().time()
+            })
+            yield f"data: {error_event}\n\n"
+
+    return StreamingResponse(
+        generate_stream(),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "Cache-Control"
+        }
+    )
 
 
 @router.get("/stats")
@@ -231,25 +314,15 @@ async def get_document_stats(
     """
     Get statistics about stored documents
     """
-    try:
-        result = await document_service.get_document_stats()
-
-        if result["success"]:
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": "Statistics retrieved successfully",
-                    "data": result
-                }
-            )
-        else:
-            raise HTTPException(status_code=500, detail=result["message"])
+    result = await document_service.get_document_stats()
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Internal server error: {str(e)}")
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "Statistics retrieved successfully",
+            "data": result
+        }
+    )
 
 
 @router.get("/health")
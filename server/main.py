@@ -1,8 +1,44 @@
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from controller.document_controller import router as document_router
+from fastapi.responses import JSONResponse
+from controller.document_controller import router as document_router, get_document_service, reset_document_service
+from service.document_service import reset_llm
+from service.exceptions import ServiceError
+from config.chroma import reset_embeddings
+from config.http_clients import close_http_clients
+
+
+def _log_warmup_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error warming up document service: {task.exception()}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the shared document service once at startup, and warm up its
+    # clients in the background so the first request doesn't pay the cold start
+    warmup_task = None
+    try:
+        document_service = get_document_service()
+        warmup_task = asyncio.create_task(asyncio.to_thread(document_service.warmup))
+        warmup_task.add_done_callback(_log_warmup_error)
+    except Exception as e:
+        # Don't block startup - the service is built lazily on the first request instead
+        print(f"Error initializing document service: {e}")
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    await close_http_clients()
+    # Everything holding the closed clients is rebuilt on the next startup
+    reset_document_service()
+    reset_llm()
+    reset_embeddings()
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Ask Docs API",
     version="1.0.0",
     description="A document Q&A system with vector search capabilities"
@@ -21,6 +57,24 @@ app.add_middleware(
 app.include_router(document_router)
 
 
+@app.exception_handler(ServiceError)
+async def service_error_handler(request: Request, exc: ServiceError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.message, "error": exc.error}
+    )
+
+
+# Last resort only: a handler for Exception runs outside the CORS middleware, so
+# document routes report their unexpected errors as ServiceError instead
+@app.exception_handler(Exception)
+async def unhandled_error_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=500,
+        content={"detail": f"Internal server error: {str(exc)}"}
+    )
+
+
 @app.get("/")
 async def root():
     return {
@@ -28,6 +82,7 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "upload_document": "/api/documents/upload",
+            "upload_documents": "/api/documents/upload/batch",
             "query_documents": "/api/documents/query",
             "query_documents_stream": "/api/documents/query/stream",
             "document_stats": "/api/documents/stats",
@@ -39,7 +94,7 @@ async def root():
             "smart_search": "Document-specific search with global fallback",
             # TODO: It requires enhancement
             "streaming": "Real-time query responses with Server-Sent Events",
-            "contextual_compression": "Automatic result sanitization and deduplication",
+            "result_sanitization": "Duplicate and low-relevance chunk filtering with MMR re-ranking",
             "openai_formatting": "Human-readable answer formatting"
         }
     }
@@ -1,78 +1,488 @@
 import os
-from typing import List, Dict, Any, Optional, AsyncGenerator
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
 from langchain.schema import Document
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import LLMChainExtractor
-from langchain_community.chat_models import ChatOpenAI
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from semantic_text_splitter import TextSplitter
+from datasketch import MinHash, MinHashLSH
 from config.chroma import get_vectorstore, get_client
-import uuid
-import json
+from config.http_clients import get_http_client, get_http_async_client
+from config.rate_limit import call_openai, open_openai_stream
+from service.embedding_cache import EmbeddingCache
+from service.exceptions import ServiceError
+import hashlib
+import diskcache
+import orjson
+import tiktoken
 import asyncio
+import threading
+import time
+from contextlib import AsyncExitStack
+import numpy as np
+
+
+# OpenAI rejects embeddings requests over 300k tokens in total, so cap each
+# request at 1000 inputs and 250k tokens, counted with the embedding model's
+# tokenizer (characters per token vary widely by language: ~4 English, ~1 CJK)
+EMBEDDING_BATCH_SIZE = 1000
+EMBEDDING_BATCH_MAX_TOKENS = 250_000
+
+
+def _count_tokens(texts: List[str], model: str) -> List[int]:
+    """
+    Token count of each text for the embedding model - falls back to one token
+    per character, an upper bound for nearly all text, if the encoding can't be loaded
+    """
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Error loading tokenizer for {model}: {e}")
+        return [len(text) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+# Shared across requests so repeat questions skip embedding, search and the LLM
+query_cache = EmbeddingCache(similarity_threshold=0.95)
+
+# Chunk size / overlap in characters
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Optional: size chunks in tokens of this tiktoken model instead of characters
+# (~4 characters per token). Tokenization runs inside the Rust splitter, so
+# candidate splits are measured without a Python call per split.
+CHUNK_TOKENIZER_MODEL = os.getenv("CHUNK_TOKENIZER_MODEL")
+CHARS_PER_TOKEN = 4
+
+
+def _build_text_splitter() -> TextSplitter:
+    if CHUNK_TOKENIZER_MODEL:
+        return TextSplitter.from_tiktoken_model(
+            CHUNK_TOKENIZER_MODEL,
+            CHUNK_SIZE // CHARS_PER_TOKEN,
+            overlap=CHUNK_OVERLAP // CHARS_PER_TOKEN
+        )
+    return TextSplitter(capacity=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+
+
+# Built once per process and shared by every DocumentService (Rust-backed splitter)
+TEXT_SPLITTER = _build_text_splitter()
+
+# Near-duplicate chunks (e.g. repeated headers / footers) are dropped before
+# embedding: MinHash over 5-word shingles, Jaccard similarity >= 0.9
+DEDUP_THRESHOLD = 0.9
+DEDUP_NUM_PERM = 128
+# LSH banding only finds candidates probabilistically (at threshold 0.9 it misses
+# most 0.9 pairs), so query it looser and check the estimated Jaccard exactly
+DEDUP_CANDIDATE_THRESHOLD = 0.7
+DEDUP_SHINGLE_SIZE = 5
+
+
+def _chunk_minhash(chunk: str) -> MinHash:
+    words = chunk.lower().split()
+    shingles = [
+        " ".join(words[i:i + DEDUP_SHINGLE_SIZE]).encode("utf-8")
+        for i in range(max(len(words) - DEDUP_SHINGLE_SIZE + 1, 1))
+    ]
+    minhash = MinHash(num_perm=DEDUP_NUM_PERM)
+    minhash.update_batch(shingles)
+    return minhash
+
+
+def _deduplicate_chunks(chunks: List[str]) -> List[Tuple[int, str]]:
+    """
+    Drop chunks that are near-duplicates of an earlier chunk of the same document,
+    keeping each survivor's original position for its chunk ID
+    """
+    lsh = MinHashLSH(threshold=DEDUP_CANDIDATE_THRESHOLD, num_perm=DEDUP_NUM_PERM)
+    minhashes = {}
+    kept = []
+    for i, chunk in enumerate(chunks):
+        minhash = _chunk_minhash(chunk)
+        if any(minhash.jaccard(minhashes[key]) >= DEDUP_THRESHOLD for key in lsh.query(minhash)):
+            continue
+        key = str(i)
+        lsh.insert(key, minhash)
+        minhashes[key] = minhash
+        kept.append((i, chunk))
+    return kept
+
+
+def _split_and_deduplicate(text_splitter: TextSplitter, contents: List[str]) -> List[Tuple[List[Tuple[int, str]], int]]:
+    chunked = text_splitter.chunk_all(contents)
+    results = []
+    for chunks in chunked:
+        kept = _deduplicate_chunks(chunks)
+        results.append((kept, len(chunks) - len(kept)))
+    return results
+
+
+# Split + embedded chunks are cached on disk by content hash, so re-uploading
+# a document skips both splitting and the embeddings requests
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", "./.chunkcache")
+
+# Chat model used to format answers
+OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+
+# Cap on generated answer tokens - answer latency grows with output length
+ANSWER_MAX_TOKENS = 300
+
+# Static answer instructions, sent as the system message ahead of the per-query
+# question and context
+ANSWER_SYSTEM_PROMPT = (
+    "Based on the context provided by the user, give a clear and comprehensive answer to their question. "
+    "Provide a well-structured answer that directly addresses the question using the information from the context. "
+    "Answer in under 150 words, prose only."
+)
+
+# Per-query part of the prompt, sent as the user message
+ANSWER_USER_PROMPT = "Question: {query}\n\nContext:\n{context}"
+
+# A confident, short top match is returned verbatim instead of calling the LLM
+DIRECT_ANSWER_MIN_SCORE = 0.85
+DIRECT_ANSWER_MAX_CHARS = 800
+
+# Embedding-based result filtering (no LLM calls): drop chunks nearly identical
+# to a better-ranked one, and chunks not similar enough to the query
+REDUNDANT_SIMILARITY_THRESHOLD = 0.95
+RELEVANCE_SCORE_THRESHOLD = 0.76
+
+# Cap on concurrent Chroma searches (run in worker threads), so ANN work
+# doesn't oversubscribe the CPU cores under load
+CHROMA_MAX_CONCURRENT = int(os.getenv("CHROMA_MAX_CONCURRENT", str(os.cpu_count() or 4)))
+_chroma_semaphore = asyncio.Semaphore(CHROMA_MAX_CONCURRENT)
+
+# Collection count for /stats, refreshed from Chroma at most every STATS_TTL seconds
+STATS_TTL = 5
+_stats_cache = {"count": None, "ts": 0}
+
+
+# Optional LLMLingua-2 prompt compression of long answer contexts - fewer input
+# tokens means faster prefill. Needs `pip install llmlingua`; off unless a model is set
+# (e.g. microsoft/llmlingua-2-xlm-roberta-large-meetingbank)
+PROMPT_COMPRESSION_MODEL = os.getenv("PROMPT_COMPRESSION_MODEL")
+PROMPT_COMPRESSION_DEVICE = os.getenv("PROMPT_COMPRESSION_DEVICE", "cpu")
+PROMPT_COMPRESSION_MIN_CHARS = 2000
+PROMPT_COMPRESSION_RATE = 0.5
+
+# Initialize the prompt compressor lazily, once per process. It is built from
+# worker threads (warmup, queries), so the lock keeps the model from loading twice
+_prompt_compressor = None
+_prompt_compressor_lock = threading.Lock()
+
+
+def get_prompt_compressor():
+    """Get the shared LLMLingua-2 prompt compressor, or None when compression is disabled"""
+    global _prompt_compressor
+    if _prompt_compressor is None and PROMPT_COMPRESSION_MODEL:
+        with _prompt_compressor_lock:
+            if _prompt_compressor is None:
+                from llmlingua import PromptCompressor
+                _prompt_compressor = PromptCompressor(
+                    model_name=PROMPT_COMPRESSION_MODEL,
+                    use_llmlingua2=True,
+                    device_map=PROMPT_COMPRESSION_DEVICE
+                )
+    return _prompt_compressor
+
+
+# Initialize the chat model lazily, once per process
+_llm = None
+
+
+def get_llm() -> ChatOpenAI:
+    """Get the shared chat model used to format answers"""
+    global _llm
+    if _llm is None:
+        _llm = ChatOpenAI(
+            model=OPENAI_CHAT_MODEL,
+            temperature=0.1,
+            max_tokens=ANSWER_MAX_TOKENS,
+            streaming=True,
+            # Retries are handled (and rate limited) by config.rate_limit only
+            max_retries=0,
+            http_client=get_http_client(),
+            http_async_client=get_http_async_client()
+        )
+    return _llm
+
+
+def reset_llm() -> None:
+    """Drop the chat model, e.g. once the shared HTTP clients it uses are closed"""
+    global _llm
+    _llm = None
+
+
+def dump_event(event: Dict[str, Any]) -> str:
+    """Serialize a streaming event with orjson (C extension, much faster than json.dumps)"""
+    return orjson.dumps(event).decode()
 
 
 class DocumentService:
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
+        self.text_splitter = TEXT_SPLITTER
         self.vectorstore = get_vectorstore("documents")
+        # Native collection for the hot paths - skips LangChain's per-item bookkeeping
+        self.collection = self.vectorstore._collection
+
+        self._chunk_cache = diskcache.Cache(CHUNK_CACHE_DIR)
+        # Cached chunks are only valid for the same splitter / dedup / embedding settings
+        self._chunk_cache_salt = (
+            f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:{CHUNK_TOKENIZER_MODEL or ''}:{DEDUP_THRESHOLD}:"
+            f"{getattr(self.vectorstore.embeddings, 'model', '')}\0"
+        ).encode("utf-8")
+
+        # Chat model is built on first use (or by warmup), not at construction
+        self._llm = None
+
+    @property
+    def llm(self) -> ChatOpenAI:
+        if self._llm is None:
+            self._llm = get_llm()
+        return self._llm
+
+    def warmup(self) -> None:
+        """
+        Pay client construction and connection setup costs up front instead of on the first request
+        """
+        _ = self.llm
+        get_prompt_compressor()
+        get_client().heartbeat()
 
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.1
-        )
+    async def _store_documents(self, files: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """
+        Split (file_content, filename, metadata) entries in parallel, embed all new chunks
+        and write them to the vector database together
+        """
+        # Documents seen before are loaded from the chunk cache
+        keys = [self._chunk_cache_key(file_content) for file_content, _, _ in files]
+        entries = await asyncio.to_thread(lambda: [self._chunk_cache.get(key) for key in keys])
+
+        misses = [i for i, entry in enumerate(entries) if entry is None]
+        if misses:
+            # Split every new document in one call - the Rust splitter parallelizes
+            # across documents - and drop near-duplicate chunks, off the event loop
+            chunked = await asyncio.to_thread(
+                _split_and_deduplicate, self.text_splitter, [files[i][0] for i in misses])
+
+            # Embed the new chunks in as few requests as possible
+            new_texts = [chunk for chunks, _ in chunked for _, chunk in chunks]
+            token_counts = await asyncio.to_thread(
+                _count_tokens, new_texts, getattr(self.vectorstore.embeddings, "model", ""))
+            batches = await asyncio.gather(*[
+                call_openai(self.vectorstore.embeddings.aembed_documents, new_texts[start:end])
+                for start, end in self._embedding_batches(token_counts)
+            ])
+            new_embeddings = [vector for batch in batches for vector in batch]
+
+            offset = 0
+            for i, (chunks, duplicates) in zip(misses, chunked):
+                vectors = np.asarray(new_embeddings[offset:offset + len(chunks)], dtype=np.float32)
+                entries[i] = (chunks, duplicates, vectors)
+                offset += len(chunks)
+            await asyncio.to_thread(
+                lambda: [self._chunk_cache.set(keys[i], entries[i]) for i in misses])
+
+        texts, embeddings, metadatas, ids = [], [], [], []
+        results = []
+        stored_ids = set()
+        for (file_content, filename, metadata), (chunks, duplicates, vectors) in zip(files, entries):
+            # Same file and content -> same ID, so re-ingesting overwrites instead of duplicating
+            document_id = self._document_id(filename, file_content)
+            doc_metadata = {
+                "filename": filename,
+                "source": filename,
+                "document_id": document_id,
+                **(metadata or {})
+            }
 
-        self.compressor = LLMChainExtractor.from_llm(self.llm)
-        self.compression_retriever = ContextualCompressionRetriever(
-            base_retriever=self.vectorstore.as_retriever(),
-            base_compressor=self.compressor
-        )
+            # The same file twice in one batch is only written once
+            if document_id not in stored_ids:
+                stored_ids.add(document_id)
+                # Every chunk shares the document's metadata (Chroma copies it on write)
+                texts.extend(chunk for _, chunk in chunks)
+                if len(chunks):
+                    embeddings.append(vectors)
+                metadatas.extend([doc_metadata] * len(chunks))
+                # Chunk IDs derived from the document ID, so re-ingest targets the same rows
+                ids.extend(f"{document_id}:{i}" for i, _ in chunks)
+
+            total = len(chunks) + duplicates
+            results.append({
+                "success": True,
+                "document_id": document_id,
+                "filename": filename,
+                "chunks_created": len(chunks),
+                "duplicates_removed": duplicates,
+                "dedup_rate": round(duplicates / total, 4) if total else 0.0,
+                "message": f"Document '{filename}' processed and stored successfully"
+            })
+
+        # Serializing and sending the write is blocking work - keep it off the event loop
+        if texts:
+            await asyncio.to_thread(self._upsert_chunks, ids, embeddings, metadatas, texts)
+
+        # New content can change any cached answer
+        query_cache.invalidate()
+        # Upserts may overwrite existing rows, so recount on the next /stats call
+        _stats_cache["ts"] = 0
+
+        return results
 
-    async def process_and_store_document(self, file_content: str, filename: str, metadata: Dict[str, Any] = {}) -> Dict[str, Any]:
+    def _upsert_chunks(self, ids: List[str], embeddings: List[np.ndarray], metadatas: List[Dict[str, Any]], texts: List[str]) -> None:
         """
-        Process document content, split into chunks, and store in vector database
+        Write chunks straight to the collection in a single request, splitting only
+        if it exceeds the server's max batch size. Upsert, so re-ingesting chunk IDs
+        that already exist overwrites them
         """
-        try:
-            # Create document object
-            doc = Document(
-                page_content=file_content,
-                metadata={
-                    "filename": filename,
-                    "source": filename,
-                    "document_id": str(uuid.uuid4()),
-                    **(metadata or {})
-                }
+        vectors = np.concatenate(embeddings)
+        max_batch_size = get_client().get_max_batch_size()
+        for start in range(0, len(texts), max_batch_size):
+            end = start + max_batch_size
+            self.collection.upsert(
+                ids=ids[start:end],
+                embeddings=vectors[start:end].tolist(),
+                metadatas=metadatas[start:end],
+                documents=texts[start:end]
             )
 
-            chunks = self.text_splitter.split_documents([doc])
-
-            texts = [chunk.page_content for chunk in chunks]
-            metadatas = [chunk.metadata for chunk in chunks]
+    async def process_and_store_document(self, file_content: str, filename: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Process document content, split into chunks, and store in vector database
+        """
+        try:
+            results = await self._store_documents([(file_content, filename, metadata)])
+            return results[0]
 
-            ids = self.vectorstore.add_texts(
-                texts=texts,
-                metadatas=metadatas
-            )
+        except Exception as e:
+            raise ServiceError(
+                f"Failed to process document '{filename}'", error=str(e)) from e
 
+    async def process_and_store_documents(self, files: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> Dict[str, Any]:
+        """
+        Process several (file_content, filename, metadata) documents at once:
+        split in parallel and stored with a single vector database write
+        """
+        try:
+            results = await self._store_documents(files)
             return {
                 "success": True,
-                "document_id": doc.metadata["document_id"],
-                "filename": filename,
-                "chunks_created": len(chunks),
-                "message": f"Document '{filename}' processed and stored successfully"
+                "documents": results,
+                "message": f"{len(results)} documents processed and stored successfully"
             }
 
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "message": f"Failed to process document '{filename}'"
-            }
+            raise ServiceError("Failed to process documents", error=str(e)) from e
 
-    def search_specific_document(self, query: str, document_id: str, k: int = 5) -> List[Document]:
+    @staticmethod
+    def _document_id(filename: str, file_content: str) -> str:
+        """
+        Deterministic document ID: BLAKE2 hash of the filename and content
+        """
+        hasher = hashlib.blake2b(f"{filename}\0".encode("utf-8"), digest_size=16)
+        hasher.update(file_content.encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _chunk_cache_key(self, file_content: str) -> str:
+        """
+        BLAKE2 hash of the document content (faster than SHA-256 in Python)
+        """
+        hasher = hashlib.blake2b(self._chunk_cache_salt, digest_size=16)
+        hasher.update(file_content.encode("utf-8"))
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _embedding_batches(token_counts: List[int]) -> List[Tuple[int, int]]:
+        """
+        Split texts, given their token counts, into (start, end) ranges that fit one embeddings request
+        """
+        batches = []
+        start, size = 0, 0
+        for i, tokens in enumerate(token_counts):
+            if i > start and (i - start >= EMBEDDING_BATCH_SIZE or size + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append((start, i))
+                start, size = i, 0
+            size += tokens
+        if start < len(token_counts):
+            batches.append((start, len(token_counts)))
+        return batches
+
+    @staticmethod
+    def _cache_namespace(document_id: Optional[str], k: int, max_tokens: Optional[int] = None) -> str:
+        """
+        Cached answers are only reused for the same document, result count and answer length
+        """
+        return f"{document_id or ''}:{k}:{max_tokens or ''}"
+
+    async def embed_query_with_cache(self, query: str, namespace: str) -> Tuple[Optional[List[float]], Optional[Dict[str, Any]]]:
+        """
+        Return (query embedding, cached result). An exact repeat skips the embedding
+        call; otherwise the query is embedded once (or its remembered embedding is
+        reused) and matched by cosine similarity
+        """
+        cached = query_cache.get(namespace, query)
+        if cached is not None:
+            return None, cached
+
+        embedding = query_cache.get_embedding(query)
+        if embedding is None:
+            embedding = await call_openai(self.vectorstore.embeddings.aembed_query, query)
+            query_cache.put_embedding(query, embedding)
+        return embedding, query_cache.get_similar(namespace, embedding)
+
+    def _mmr_search_by_vector(self, embedding: List[float], k: int, filter_dict: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """
+        Fetch 2k nearest chunks and pick k diverse ones with MMR, dropping any that
+        are near-duplicates of a better-ranked pick. Each document's similarity to
+        the query is kept in metadata["relevance_score"]
+        """
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=2 * k,
+            where=filter_dict,
+            include=["documents", "metadatas", "distances", "embeddings"]
+        )
+        if not results["ids"] or not results["ids"][0]:
+            return []
+
+        relevance_score_fn = self.vectorstore._select_relevance_score_fn()
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32),
+            results["embeddings"][0],
+            lambda_mult=0.5,
+            k=k
+        )
+
+        # Redundancy filter over the already-fetched chunk embeddings
+        vectors = np.asarray(results["embeddings"][0], dtype=np.float32)[selected]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        kept = []
+        for row in range(len(selected)):
+            if kept and float((vectors[kept] @ vectors[row]).max()) > REDUNDANT_SIMILARITY_THRESHOLD:
+                continue
+            kept.append(row)
+
+        documents = []
+        for i in [selected[row] for row in kept]:
+            metadata = dict(results["metadatas"][0][i] or {})
+            metadata["relevance_score"] = relevance_score_fn(
+                results["distances"][0][i])
+            documents.append(Document(
+                page_content=results["documents"][0][i], metadata=metadata))
+        return documents
+
+    @staticmethod
+    async def _run_search(search, *args) -> List[Document]:
+        """
+        Run a blocking Chroma search in a worker thread, under the concurrency cap
+        """
+        async with _chroma_semaphore:
+            return await asyncio.to_thread(search, *args)
+
+    def search_specific_document(self, embedding: List[float], document_id: str, k: int = 5) -> List[Document]:
         """
         Search within a specific document using document_id
         """
@@ -80,100 +490,166 @@ class DocumentService:
             # Create a filter for the specific document
             filter_dict = {"document_id": document_id}
 
-            # Search with filter
-            results = self.vectorstore.similarity_search(
-                query,
-                k=k,
-                filter=filter_dict
-            )
-
-            return results
+            # Search with filter. MMR keeps the k results diverse without an LLM pass
+            return self._mmr_search_by_vector(embedding, k, filter_dict)
         except Exception as e:
             print(f"Error searching specific document: {e}")
             return []
 
-    def search_all_documents(self, query: str, k: int = 5) -> List[Document]:
+    def search_all_documents(self, embedding: List[float], k: int = 5) -> List[Document]:
         """
         Search across all documents
         """
         try:
-            results = self.vectorstore.similarity_search(query, k=k)
-            return results
+            return self._mmr_search_by_vector(embedding, k)
         except Exception as e:
             print(f"Error searching all documents: {e}")
             return []
 
-    def sanitize_results(self, documents: List[Document], query: str) -> List[Document]:
+    def sanitize_results(self, documents: List[Document]) -> List[Document]:
         """
-        Use contextual compression to remove duplicates and compress results
+        Remove duplicate chunks and chunks below the relevance threshold from the
+        retrieved documents, keeping their order
         """
-        try:
-            # Use contextual compression retriever
-            compressed_docs = self.compression_retriever.get_relevant_documents(
-                query)
-            return compressed_docs
-        except Exception as e:
-            print(f"Error in contextual compression: {e}")
-            # Fallback to original documents
-            return documents
-
-    async def format_with_openai(self, query: str, documents: List[Document]) -> str:
+        seen = set()
+        unique_docs = []
+        for doc in documents:
+            digest = hashlib.sha1(doc.page_content.encode("utf-8")).digest()[:16]
+            if digest in seen:
+                continue
+            seen.add(digest)
+            unique_docs.append(doc)
+
+        relevant_docs = [
+            doc for doc in unique_docs
+            if doc.metadata.get("relevance_score", 1.0) >= RELEVANCE_SCORE_THRESHOLD
+        ]
+        # Always keep the best match so there is something to answer from
+        return relevant_docs or unique_docs[:1]
+
+    def direct_answer(self, documents: List[Document]) -> Optional[str]:
         """
-        Use OpenAI to format the answer in a human-readable way
+        Return the top chunk verbatim when it is a confident, short match,
+        so the LLM call can be skipped
         """
-        try:
-            # Prepare context from documents
-            context = "\n\n".join([doc.page_content for doc in documents])
-
-            # Create prompt for OpenAI
-            prompt = f"""
-            Based on the following context, provide a clear and comprehensive answer to the question.
+        top = documents[0]
+        score = top.metadata.get("relevance_score")
+        if score is not None and score > DIRECT_ANSWER_MIN_SCORE and len(top.page_content) < DIRECT_ANSWER_MAX_CHARS:
+            return top.page_content
+        return None
 
-            Question: {query}
-
-            Context:
-            {context}
-
-            Please provide a well-structured answer that directly addresses the question using the information from the context.
-            """
+    async def generate_answer(self, query: str, documents: List[Document], max_tokens: Optional[int] = None, status: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """
+        Yield the answer: the top chunk verbatim when it answers the query
+        directly, otherwise the OpenAI-formatted answer as it streams in.
+        `status["complete"]` is set to False if the answer is a fallback or was cut short
+        """
+        answer = self.direct_answer(documents)
+        if answer is not None:
+            yield answer
+            return
 
-            # Get response from OpenAI
-            response = await self.llm.ainvoke(prompt)
+        async for delta in self.format_with_openai(query, documents, max_tokens, status):
+            yield delta
 
-            # Handle different response content types
-            if isinstance(response.content, str):
-                return response.content
-            elif isinstance(response.content, list):
-                # If it's a list, join the content
-                return " ".join([str(item) for item in response.content])
-            else:
-                # Fallback: convert to string
-                return str(response.content)
+    def compress_context(self, context: str) -> str:
+        """
+        Compress the answer context with LLMLingua-2 - CPU/GPU bound, so run it off the event loop
+        """
+        result = get_prompt_compressor().compress_prompt(
+            context,
+            rate=PROMPT_COMPRESSION_RATE,
+            force_tokens=["\n", "?", "."]
+        )
+        return result["compressed_prompt"]
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        # Handle different response content types
+        if isinstance(chunk.content, str):
+            return chunk.content
+        if isinstance(chunk.content, list):
+            # If it's a list, join the content
+            return " ".join([str(item) for item in chunk.content])
+        # Fallback: convert to string
+        return str(chunk.content)
+
+    async def format_with_openai(self, query: str, documents: List[Document], max_tokens: Optional[int] = None, status: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """
+        Use OpenAI to format the answer in a human-readable way, yielding it as it is generated.
+        `max_tokens` overrides the default answer length cap for this call; `status["complete"]`
+        is set to False if the call fails and the answer is the raw context or cut short
+        """
+        # Prepare context from documents
+        context = "\n\n".join([doc.page_content for doc in documents])
+
+        # Drop uninformative tokens from long contexts before sending them
+        prompt_context = context
+        if PROMPT_COMPRESSION_MODEL and len(context) > PROMPT_COMPRESSION_MIN_CHARS:
+            try:
+                prompt_context = await asyncio.to_thread(self.compress_context, context)
+            except Exception as e:
+                print(f"Error compressing prompt context: {e}")
+
+        # Create prompt for OpenAI: static instructions first, then the per-query part
+        prompt = [
+            SystemMessage(content=ANSWER_SYSTEM_PROMPT),
+            HumanMessage(content=ANSWER_USER_PROMPT.format(query=query.strip(), context=prompt_context.strip()))
+        ]
+
+        streamed = False
+        try:
+            # Stream the response from OpenAI token by token. Opening the stream
+            # is retried on rate limits until the first chunk arrives
+            async with AsyncExitStack() as stack:
+                llm = self.llm.bind(max_tokens=max_tokens) if max_tokens else self.llm
+                stream, first = await open_openai_stream(lambda: llm.astream(prompt), stack)
+                if first is not None:
+                    delta = self._chunk_text(first)
+                    if delta:
+                        streamed = True
+                        yield delta
+
+                async for chunk in stream:
+                    delta = self._chunk_text(chunk)
+                    if delta:
+                        streamed = True
+                        yield delta
 
         except Exception as e:
             print(f"Error formatting with OpenAI: {e}")
-            # Fallback to simple concatenation
-            return "\n\n".join([doc.page_content for doc in documents])
+            if status is not None:
+                status["complete"] = False
+            # Fallback to simple concatenation if nothing was generated yet
+            if not streamed:
+                yield context
 
-    async def search_documents(self, query: str, k: int = 5, document_id: Optional[str] = None) -> Dict[str, Any]:
+    async def search_documents(self, query: str, k: int = 5, document_id: Optional[str] = None, max_tokens: Optional[int] = None) -> Dict[str, Any]:
         """
         Smart search: document-specific first, then global fallback with sanitization and formatting
         """
         try:
+            # 0. Serve repeat / near-duplicate questions from the semantic cache
+            namespace = self._cache_namespace(document_id, k, max_tokens)
+            embedding, cached = await self.embed_query_with_cache(query, namespace)
+            if cached is not None:
+                return {**cached, "query": query}
+
             results = []
             search_type = "global"
 
             # 1. Search specific document first (if document_id provided)
             if document_id:
-                doc_results = self.search_specific_document(
-                    query, document_id, k)
+                doc_results = await self._run_search(
+                    self.search_specific_document, embedding, document_id, k)
                 if doc_results:
                     results = doc_results
                     search_type = "document_specific"
 
             # 2. If no results from specific document, search globally
             if not results:
-                global_results = self.search_all_documents(query, k)
+                global_results = await self._run_search(
+                    self.search_all_documents, embedding, k)
                 results = global_results
                 search_type = "global"
 
@@ -186,131 +662,183 @@ class DocumentService:
                     "total_results": 0
                 }
 
-            # 3. Sanitize results using contextual compression
-            sanitized_results = self.sanitize_results(results, query)
+            # 3. Sanitize results: drop duplicate chunks and chunks below the relevance threshold
+            sanitized_results = self.sanitize_results(results)
 
-            # 4. Format answer using OpenAI
-            formatted_answer = await self.format_with_openai(query, sanitized_results)
+            # 4. Format answer using OpenAI, unless the top match answers it directly
+            status = {"complete": True}
+            formatted_answer = "".join([
+                delta async for delta in self.generate_answer(query, sanitized_results, max_tokens, status)])
 
-            return {
+            result = {
                 "success": True,
                 "query": query,
                 "answer": formatted_answer,
                 "search_type": search_type,
                 "total_results": len(sanitized_results),
-                "sources": list(set([doc.metadata.get("filename", "Unknown") for doc in sanitized_results]))
+                "sources": self._sources(sanitized_results)
             }
+            # Don't cache a fallback or truncated answer - retry the LLM next time
+            if status["complete"]:
+                query_cache.put(namespace, query, embedding, result)
+            return result
 
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "message": "Failed to search documents"
-            }
-
-    async def search_documents_stream(self, query: str, k: int = 5, document_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+            raise ServiceError("Failed to search documents", error=str(e)) from e
+
+    @staticmethod
+    def _sources(docs: List[Document]) -> List[str]:
+        """Unique source filenames in rank order"""
+        return list(dict.fromkeys(doc.metadata.get("filename", "Unknown") for doc in docs))
+
+    @staticmethod
+    def _answer_complete_event(result: Dict[str, Any], timestamp: float) -> Dict[str, Any]:
+        return {
+            "event": "answer_complete",
+            "answer": result["answer"],
+            "search_type": result["search_type"],
+            "total_results": result["total_results"],
+            "sources": result["sources"],
+            "timestamp": timestamp
+        }
+
+    async def search_documents_stream(self, query: str, k: int = 5, document_id: Optional[str] = None, max_tokens: Optional[int] = None) -> AsyncGenerator[str, None]:
         """
         Streaming version of search_documents that yields events as the process progresses
         """
+        loop = asyncio.get_running_loop()
         try:
             # Send start event
-            yield json.dumps({
+            yield dump_event({
                 "event": "start",
                 "query": query,
-                "timestamp": asyncio.get_event_loop().time()
+                "timestamp": loop.time()
             })
 
+            # Serve repeat / near-duplicate questions from the semantic cache;
+            # otherwise embed the query once and share it between both search paths
+            namespace = self._cache_namespace(document_id, k, max_tokens)
+            embedding, cached = await self.embed_query_with_cache(query, namespace)
+            if cached is not None:
+                yield dump_event(self._answer_complete_event(cached, loop.time()))
+                yield dump_event({
+                    "event": "complete",
+                    "timestamp": loop.time()
+                })
+                return
+
             results = []
             search_type = "global"
 
             # 1. Search specific document first (if document_id provided)
             if document_id:
-                yield json.dumps({
+                # Run the blocking Chroma query in a worker thread, started before
+                # the progress event is sent so the two overlap
+                doc_task = asyncio.create_task(self._run_search(
+                    self.search_specific_document, embedding, document_id, k))
+
+                yield dump_event({
                     "event": "searching_document",
                     "document_id": document_id,
-                    "timestamp": asyncio.get_event_loop().time()
+                    "timestamp": loop.time()
                 })
 
-                doc_results = self.search_specific_document(
-                    query, document_id, k)
+                doc_results = await doc_task
                 if doc_results:
                     results = doc_results
                     search_type = "document_specific"
 
-                    yield json.dumps({
+                    yield dump_event({
                         "event": "document_search_complete",
                         "results_count": len(results),
-                        "timestamp": asyncio.get_event_loop().time()
+                        "timestamp": loop.time()
                     })
 
             # 2. If no results from specific document, search globally
             if not results:
-                yield json.dumps({
+                global_task = asyncio.create_task(self._run_search(
+                    self.search_all_documents, embedding, k))
+
+                yield dump_event({
                     "event": "searching_global",
-                    "timestamp": asyncio.get_event_loop().time()
+                    "timestamp": loop.time()
                 })
 
-                global_results = self.search_all_documents(query, k)
+                global_results = await global_task
                 results = global_results
                 search_type = "global"
 
-                yield json.dumps({
+                yield dump_event({
                     "event": "global_search_complete",
                     "results_count": len(results),
-                    "timestamp": asyncio.get_event_loop().time()
+                    "timestamp": loop.time()
                 })
 
             if not results:
-                yield json.dumps({
+                yield dump_event({
                     "event": "no_results",
                     "message": "No relevant information found in the documents.",
-                    "timestamp": asyncio.get_event_loop().time()
+                    "timestamp": loop.time()
                 })
                 return
 
-            # 3. Sanitize results using contextual compression
-            yield json.dumps({
+            # 3. Sanitize results: drop duplicate chunks and chunks below the relevance threshold
+            yield dump_event({
                 "event": "sanitizing_results",
-                "timestamp": asyncio.get_event_loop().time()
+                "timestamp": loop.time()
             })
 
-            sanitized_results = self.sanitize_results(results, query)
+            sanitized_results = self.sanitize_results(results)
 
-            yield json.dumps({
+            yield dump_event({
                 "event": "sanitization_complete",
                 "original_count": len(results),
                 "sanitized_count": len(sanitized_results),
-                "timestamp": asyncio.get_event_loop().time()
+                "timestamp": loop.time()
             })
 
-            # 4. Format answer using OpenAI
-            yield json.dumps({
+            # 4. Format answer using OpenAI, unless the top match answers it directly
+            yield dump_event({
                 "event": "generating_answer",
-                "timestamp": asyncio.get_event_loop().time()
+                "timestamp": loop.time()
             })
 
-            formatted_answer = await self.format_with_openai(query, sanitized_results)
+            answer_parts = []
+            status = {"complete": True}
+            async for delta in self.generate_answer(query, sanitized_results, max_tokens, status):
+                answer_parts.append(delta)
+                yield dump_event({
+                    "event": "token",
+                    "delta": delta,
+                    "timestamp": loop.time()
+                })
+            formatted_answer = "".join(answer_parts)
 
-            yield json.dumps({
-                "event": "answer_complete",
+            result = {
+                "success": True,
+                "query": query,
                 "answer": formatted_answer,
                 "search_type": search_type,
                 "total_results": len(sanitized_results),
-                "sources": list(set([doc.metadata.get("filename", "Unknown") for doc in sanitized_results])),
-                "timestamp": asyncio.get_event_loop().time()
-            })
+                "sources": self._sources(sanitized_results)
+            }
+            # Don't cache a fallback or truncated answer - retry the LLM next time
+            if status["complete"]:
+                query_cache.put(namespace, query, embedding, result)
+
+            yield dump_event(self._answer_complete_event(result, loop.time()))
 
             # 5. Send completion event
-            yield json.dumps({
+            yield dump_event({
                 "event": "complete",
-                "timestamp": asyncio.get_event_loop().time()
+                "timestamp": loop.time()
             })
 
         except Exception as e:
-            yield json.dumps({
+            yield dump_event({
                 "event": "error",
                 "error": str(e),
-                "timestamp": asyncio.get_event_loop().time()
+                "timestamp": loop.time()
             })
 
     async def get_document_stats(self) -> Dict[str, Any]:
@@ -318,10 +846,11 @@ class DocumentService:
         Get statistics about stored documents
         """
         try:
-            # Get document count using the underlying ChromaDB client
-            client = get_client()
-            collection = client.get_collection(name="documents")
-            count = collection.count()
+            count = _stats_cache["count"]
+            if count is None or time.time() - _stats_cache["ts"] >= STATS_TTL:
+                # Get document count using the underlying ChromaDB collection
+                count = self.collection.count()
+                _stats_cache.update(count=count, ts=time.time())
 
             return {
                 "success": True,
@@ -330,8 +859,5 @@ class DocumentService:
             }
 
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "message": "Failed to get document statistics"
-            }
+            raise ServiceError(
+                "Failed to get document statistics", error=str(e)) from e
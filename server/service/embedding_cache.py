@@ -0,0 +1,184 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Semantic query cache: an LRU keyed by SHA-256 of the query text, with a
+    cosine-similarity fallback over the cached query embeddings.
+    Entries are namespaced (e.g. by document_id) and expire after `ttl` seconds.
+
+    Embeddings are normalized once on insert and kept as rows of one contiguous
+    float32 matrix, so a similarity lookup is a single `matrix @ query` product.
+
+    Raw query embeddings are also remembered separately by query text: they don't
+    depend on the stored documents, so they survive `invalidate()`.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600, similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # key -> row in the matrix, in LRU order
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._mat: Optional[np.ndarray] = None
+        self._size = 0
+        self._free: List[int] = []
+        # Per-row bookkeeping, parallel to the matrix rows
+        self._keys: List[Optional[str]] = []
+        self._namespaces: List[Optional[str]] = []
+        self._payloads: List[Optional[Dict[str, Any]]] = []
+        self._expires = np.zeros(0, dtype=np.float64)
+        # query key -> raw embedding, in LRU order
+        self._query_embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(namespace: str, query: str) -> str:
+        normalized = " ".join(query.lower().split())
+        return hashlib.sha256(f"{namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, key: str) -> None:
+        row = self._entries.pop(key)
+        self._keys[row] = None
+        self._namespaces[row] = None
+        self._payloads[row] = None
+        self._expires[row] = 0
+        self._free.append(row)
+
+    def _allocate_row(self, dim: int) -> int:
+        if self._free:
+            return self._free.pop()
+
+        if self._mat is None:
+            self._mat = np.zeros((8, dim), dtype=np.float32)
+            self._expires = np.zeros(8, dtype=np.float64)
+        elif self._size == self._mat.shape[0]:
+            # Grow by doubling so inserts stay amortized O(dim)
+            capacity = min(self._size * 2, max(self.max_size, 8))
+            mat = np.zeros((capacity, dim), dtype=np.float32)
+            mat[:self._size] = self._mat
+            self._mat = mat
+            expires = np.zeros(capacity, dtype=np.float64)
+            expires[:self._size] = self._expires
+            self._expires = expires
+
+        row = self._size
+        self._size += 1
+        self._keys.append(None)
+        self._namespaces.append(None)
+        self._payloads.append(None)
+        return row
+
+    def get(self, namespace: str, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Exact lookup by query text - a hit skips the embedding call entirely
+        """
+        key = self._key(namespace, query)
+        with self._lock:
+            row = self._entries.get(key)
+            if row is None:
+                return None
+            if self._expires[row] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return self._payloads[row]
+
+    def get_embedding(self, query: str) -> Optional[List[float]]:
+        """
+        Return the remembered embedding of a query, if any
+        """
+        key = self._key("", query)
+        with self._lock:
+            embedding = self._query_embeddings.get(key)
+            if embedding is not None:
+                self._query_embeddings.move_to_end(key)
+            return embedding
+
+    def put_embedding(self, query: str, embedding: List[float]) -> None:
+        """
+        Remember the embedding of a query so asking it again skips the embedding call
+        """
+        key = self._key("", query)
+        with self._lock:
+            self._query_embeddings[key] = embedding
+            self._query_embeddings.move_to_end(key)
+            while len(self._query_embeddings) > self.max_size:
+                self._query_embeddings.popitem(last=False)
+
+    def get_similar(self, namespace: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Return the payload of the most similar cached query in `namespace`
+        if its cosine similarity reaches the threshold
+        """
+        query_vector = self._normalize(embedding)
+
+        with self._lock:
+            if not self._entries:
+                return None
+
+            # Rows are pre-normalized, so the dot product is the cosine similarity
+            sims = self._mat[:self._size] @ query_vector
+            valid = self._expires[:self._size] >= time.monotonic()
+            valid &= np.fromiter(
+                (entry_namespace == namespace for entry_namespace in self._namespaces),
+                dtype=bool,
+                count=self._size
+            )
+            if not valid.any():
+                return None
+
+            sims[~valid] = -np.inf
+            row = int(sims.argmax())
+            if sims[row] < self.similarity_threshold:
+                return None
+
+            self._entries.move_to_end(self._keys[row])
+            return self._payloads[row]
+
+    def put(self, namespace: str, query: str, embedding: List[float], payload: Dict[str, Any]) -> None:
+        """
+        Store the answer payload (answer, sources, ...) for a query embedding
+        """
+        key = self._key(namespace, query)
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_size:
+                self._remove(next(iter(self._entries)))
+
+            row = self._allocate_row(vector.shape[0])
+            self._mat[row] = vector
+            self._keys[row] = key
+            self._namespaces[row] = namespace
+            self._payloads[row] = payload
+            self._expires[row] = time.monotonic() + self.ttl
+            self._entries[key] = row
+
+    def invalidate(self) -> None:
+        """
+        Drop every cached answer, e.g. after new documents are stored
+        """
+        with self._lock:
+            self._entries.clear()
+            self._mat = None
+            self._size = 0
+            self._free = []
+            self._keys = []
+            self._namespaces = []
+            self._payloads = []
+            self._expires = np.zeros(0, dtype=np.float64)
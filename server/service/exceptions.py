@@ -0,0 +1,14 @@
+from typing import Optional
+
+
+class ServiceError(Exception):
+    """
+    Raised by services when an operation fails - turned into a JSON error
+    response by the exception handler registered in main.py
+    """
+
+    def __init__(self, message: str, status_code: int = 500, error: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.error = error